@@ -12,6 +12,15 @@ class DicomConstants(Enum):
     SUFFIX = ".dcm"
 
 
+class ImageFormatConstants(Enum):
+    """ImageFormatConstants
+    Image formats available to store the PixelData DICOM field
+    """
+    FPNGE = "fpnge"
+    LZ4 = "lz4"
+    PNG = "png"
+
+
 class JsonConstants(Enum):
     """JsonConstants
     Constants associated to JSON data
@@ -24,8 +33,17 @@ class JsonConstants(Enum):
     TEMPLATE = "template"
 
 
+class Lz4Constants(Enum):
+    """Lz4Constants
+    Constants associated to byte-shuffled LZ4 data
+    """
+    COMPRESSION_LEVEL = 1
+    SUFFIX = ".lz4"
+
+
 class PngConstants(Enum):
     """PngConstants
     Constants associated to PNG data
     """
     SUFFIX = ".png"
+    WINDOW = "_window"
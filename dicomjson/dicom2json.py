@@ -1,19 +1,43 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
+from functools import lru_cache, partial
 import json
 import logging
-from logging import config
+from logging import config, handlers
+import multiprocessing
+import os
 from pathlib import Path
 import cv2
 import numpy as np
 import yaml
 from pydicom import dcmread
 from pydicom.errors import InvalidDicomError
-from constants import DicomConstants, JsonConstants, PngConstants
+from pydicom.multival import MultiValue
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from constants import DicomConstants, ImageFormatConstants, JsonConstants, Lz4Constants, PngConstants
 
 DEFAULT_OUTPUT_DIR = Path(__file__).parent / Path("output")
+DEFAULT_PNG_COMPRESSION = 1
+DEFAULT_IMAGE_FORMAT = ImageFormatConstants.PNG.value
+# BitsAllocated values which fit in a PNG image without loss
+PNG_BITS_ALLOCATED = (1, 8, 16)
+# BitsAllocated values for which json2dicom rebuilds the exact PixelData from the image
+LOSSLESS_BITS_ALLOCATED = (8, 16)
+# DICOM files are parsed through a 1 MB read buffer to limit read syscalls
+DICOM_BUFFER_SIZE = 1 << 20
+DEFAULT_JOBS = os.cpu_count() or 1
+# Each worker process gets about this number of DICOM files batches
+JOBS_BATCHES = 4
+# JSON files are written through a 1 MB buffer, json.dump emits many small chunks
+JSON_BUFFER_SIZE = 1 << 20
 
 # Load logger configuration from YAML file
 with open(Path(__file__).parent / Path("logger_config.yaml"), 'rt') as f:
@@ -23,17 +47,278 @@ with open(Path(__file__).parent / Path("logger_config.yaml"), 'rt') as f:
 logger = logging.getLogger('root')
 
 
-def my_json_dumps(data):
-    """my_json_dumps
-    JSON formatter
+# Output directory file descriptor of a worker process (see _init_worker)
+_worker_output_dir_fd = None
+
+
+def open_output_directory():
+    """open_output_directory
+    Open the output directory, so output files are created relative
+    to it without resolving the full path for each of them
+
+    Returns:
+        int -- Output directory file descriptor, None if the platform
+        does not support dir_fd (e.g. Windows)
+    """
+    if os.open not in os.supports_dir_fd or not hasattr(os, "O_DIRECTORY"):
+        return None
+    return os.open(str(DEFAULT_OUTPUT_DIR), os.O_RDONLY | os.O_DIRECTORY)
+
+
+@contextmanager
+def output_directory():
+    """output_directory
+    Output directory file descriptor, closed on exit
+
+    Yields:
+        int -- Output directory file descriptor (see open_output_directory)
+    """
+    output_dir_fd = open_output_directory()
+    try:
+        yield output_dir_fd
+    finally:
+        if output_dir_fd is not None:
+            os.close(output_dir_fd)
+
+
+def _init_worker(log_queue):
+    """_init_worker
+    Send worker process logs to the main process, which is the only one
+    writing the rotating log file, and open the output directory once
+    per worker process, it is closed when the process exits
+
+    Arguments:
+        log_queue {multiprocessing.Queue} -- Log records queue of the main process
+    """
+    global _worker_output_dir_fd
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        handler.close()
+    root_logger.addHandler(handlers.QueueHandler(log_queue))
+    _worker_output_dir_fd = open_output_directory()
+
+
+def add_suffix(filepath, suffix):
+    """add_suffix
+    Append suffix to the full file name. Path.with_suffix would replace
+    everything after the last dot of UID named files (e.g. '1.2.840.113')
+
+    Arguments:
+        filepath {Path} -- Filepath without suffix
+        suffix {str} -- Suffix to append
+
+    Returns:
+        Path -- Filepath with suffix
+    """
+    return filepath.parent / (filepath.name + suffix)
+
+
+def open_output_file(output_filepath, mode, output_dir_fd=None, buffering=-1):
+    """open_output_file
+    Open an output file for writing, relative to the output directory
+    file descriptor when available
+
+    Arguments:
+        output_filepath {Path} -- Output filepath in DEFAULT_OUTPUT_DIR
+        mode {str} -- Binary writing mode, "wb"
+        output_dir_fd {int} -- Output directory file descriptor (see output_directory)
+        buffering {int} -- Buffer size, as for open
+
+    Returns:
+        file -- Opened file
+    """
+    if output_dir_fd is None:
+        return open(str(output_filepath), mode, buffering=buffering)
+    output_fd = os.open(output_filepath.name,
+                        os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666,
+                        dir_fd=output_dir_fd)
+    return open(output_fd, mode, buffering=buffering)
+
+
+def _orjson_default(value):
+    """_orjson_default
+    Convert values orjson refuses, like pydicom DSfloat (float subclass)
+
+    Arguments:
+        value {object} -- Value to convert
+
+    Raises:
+        TypeError: Value cannot be converted
+
+    Returns:
+        object -- JSON native value
+    """
+    for json_type in (float, int, str):
+        if isinstance(value, json_type):
+            return json_type(value)
+    raise TypeError("Type is not JSON serializable: {}".format(
+        type(value).__name__))
+
+
+def my_json_dump(data, json_file, compact=False):
+    """my_json_dump
+    JSON formatter, streamed directly into the file
+    orjson is used when installed, stdlib json otherwise
 
     Arguments:
         data {str} -- Data to JSON beautify
+        json_file {file} -- Opened binary file to write
+        compact {bool} -- Write minified JSON without key sorting
+    """
+    if orjson:
+        option = None if compact else orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS
+        json_file.write(orjson.dumps(
+            data, default=_orjson_default, option=option))
+        return
+
+    json_text_file = io.TextIOWrapper(json_file, encoding="utf-8")
+    if compact:
+        json.dump(data, json_text_file, separators=(",", ":"))
+    else:
+        json.dump(data, json_text_file, indent=2, sort_keys=True)
+    # Give the binary file back to the caller, which closes it
+    json_text_file.flush()
+    json_text_file.detach()
+
+
+def _window_kernel(src, out, lower, scale, rescale_slope, rescale_intercept):
+    """_window_kernel
+    Rescale, window and cast each pixel in a single pass
+
+    Arguments:
+        src {numpy.ndarray} -- Stored pixel values
+        out {numpy.ndarray} -- Preallocated 8 bits output image
+        lower {float} -- Lowest value of the window
+        scale {float} -- Output grey levels per window unit
+        rescale_slope {float} -- DICOM RescaleSlope
+        rescale_intercept {float} -- DICOM RescaleIntercept
+    """
+    for row in range(src.shape[0]):
+        for column in range(src.shape[1]):
+            value = ((src[row, column] * rescale_slope + rescale_intercept) - lower) * scale
+            if value < 0:
+                value = 0
+            elif value > 255:
+                value = 255
+            out[row, column] = value
+
+
+@lru_cache(maxsize=None)
+def _compiled_window_kernel():
+    """_compiled_window_kernel
+    Compile the window kernel with numba, once per process
+    Single threaded: files are already converted in parallel processes
 
     Returns:
-        str -- Data beautified
+        function -- Compiled kernel, None if numba is not installed
     """
-    return json.dumps(data, indent=2, sort_keys=True)
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.njit(cache=True)(_window_kernel)
+
+
+def window_image(dicom_image, window_center, window_width,
+                 rescale_slope=1.0, rescale_intercept=0.0):
+    """window_image
+    Apply DICOM rescale and VOI window to get a 8 bits displayable image
+    The numba kernel is used when installed, numpy otherwise
+
+    Arguments:
+        dicom_image {numpy.ndarray} -- Image extracted from PixelData
+        window_center {float} -- DICOM WindowCenter
+        window_width {float} -- DICOM WindowWidth
+        rescale_slope {float} -- DICOM RescaleSlope
+        rescale_intercept {float} -- DICOM RescaleIntercept
+
+    Returns:
+        numpy.ndarray -- 8 bits windowed image
+    """
+    window_width = max(float(window_width), 1.0)
+    lower = float(window_center) - window_width / 2
+    scale = 255.0 / window_width
+    windowed_image = np.empty(dicom_image.shape, dtype=np.uint8)
+    window_kernel = _compiled_window_kernel()
+    if window_kernel:
+        window_kernel(dicom_image, windowed_image, lower, scale,
+                      float(rescale_slope), float(rescale_intercept))
+    else:
+        np.clip((dicom_image * float(rescale_slope) + float(rescale_intercept) - lower) * scale,
+                0, 255, out=windowed_image, casting="unsafe")
+    return windowed_image
+
+
+def write_image(output_filepath, dicom_image, image_format, png_compression,
+                output_dir_fd=None):
+    """write_image
+    Write DICOM image with the requested format
+
+    Arguments:
+        output_filepath {Path} -- Output filepath without suffix
+        dicom_image {numpy.ndarray} -- Image extracted from PixelData
+        image_format {str} -- Image format (see ImageFormatConstants)
+        png_compression {int} -- PNG compression level (0-9)
+        output_dir_fd {int} -- Output directory file descriptor (see output_directory)
+
+    Raises:
+        ValueError: Unrecognized image format or missing encoder library
+
+    Returns:
+        Path -- Written image filepath
+    """
+    # PNG has no signed samples: keep the raw bits with the unsigned dtype
+    if dicom_image.dtype.kind == "i":
+        dicom_image = dicom_image.view(
+            "u{}".format(dicom_image.dtype.itemsize))
+
+    if image_format == ImageFormatConstants.LZ4.value:
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ValueError(
+                "'lz4' python package is required for '{}' image format".format(image_format))
+        # Byte-shuffle: group bytes by significance so LZ4 sees long runs
+        itemsize = dicom_image.dtype.itemsize
+        shuffled_image = np.ascontiguousarray(
+            dicom_image.view(np.uint8).reshape(-1, itemsize).T)
+        output_image_filepath = add_suffix(
+            output_filepath, Lz4Constants.SUFFIX.value)
+        with open_output_file(output_image_filepath, "wb", output_dir_fd) as image_file:
+            image_file.write(lz4.frame.compress(
+                shuffled_image, compression_level=Lz4Constants.COMPRESSION_LEVEL.value))
+    elif image_format == ImageFormatConstants.FPNGE.value:
+        try:
+            import fpnge
+        except ImportError:
+            raise ValueError(
+                "'fpnge' python package is required for '{}' image format".format(image_format))
+        output_image_filepath = add_suffix(
+            output_filepath, PngConstants.SUFFIX.value)
+        with open_output_file(output_image_filepath, "wb", output_dir_fd) as image_file:
+            image_file.write(fpnge.fromNP(dicom_image))
+    elif image_format == ImageFormatConstants.PNG.value:
+        output_image_filepath = add_suffix(
+            output_filepath, PngConstants.SUFFIX.value)
+        # Low deflate level with RLE strategy: much faster encode,
+        # still compact on the flat backgrounds of medical images
+        encoded, png_buffer = cv2.imencode(
+            PngConstants.SUFFIX.value,
+            dicom_image,
+            [cv2.IMWRITE_PNG_COMPRESSION, png_compression,
+             cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE])  # pylint: disable=E1101
+        if not encoded:
+            png_error = "Cannot encode PNG image '{}'".format(
+                output_image_filepath)
+            raise ValueError(png_error)
+        with open_output_file(output_image_filepath, "wb", output_dir_fd) as image_file:
+            image_file.write(png_buffer)
+    else:
+        image_format_error = "Unrecognized image format '{}'".format(
+            image_format)
+        raise ValueError(image_format_error)
+    return output_image_filepath
 
 
 @dataclass
@@ -44,93 +329,171 @@ class DicomConvertedData:
     template: str
 
 
-def convert_dicom_to_data(input_file, remove_dicom_fields, converted_data):
+def convert_dicom_to_data(input_file, remove_dicom_fields,
+                          png_compression=DEFAULT_PNG_COMPRESSION,
+                          image_format=DEFAULT_IMAGE_FORMAT,
+                          compact=False,
+                          window=False,
+                          no_image=False,
+                          output_dir_fd=None):
     """
     Convert DICOM file to JSON using pydicom library
 
     Arguments:
         input_file {str} -- DICOM file location
         remove_dicom_fields {list} -- DICOM field name to not save in JSON
-        converted_data {list} -- DicomConvertedData items list
+        png_compression {int} -- PNG compression level (0-9)
+        image_format {str} -- Image format (see ImageFormatConstants)
+        compact {bool} -- Write minified JSON without key sorting
+        window {bool} -- Also write a 8 bits PNG preview windowed with WindowCenter/WindowWidth
+        no_image {bool} -- Do not read PixelData nor write the image file
+        output_dir_fd {int} -- Output directory file descriptor (see open_output_directory)
+
+    Returns:
+        DicomConvertedData -- Converted DICOM item
     """
     try:
-        dicom_dataset = dcmread(str(input_file))
+        logger.debug("Convert %s", str(input_file.resolve()))
+        with open(str(input_file), "rb", buffering=DICOM_BUFFER_SIZE) as dicom_file:
+            dicom_dataset = dcmread(dicom_file, stop_before_pixels=no_image)
 
         # Extract DICOM data
         rows = dicom_dataset.get('Rows')
         columns = dicom_dataset.get('Columns')
         pixel_data = dicom_dataset.get('PixelData')
-        bits_stored = dicom_dataset.get('BitsStored')
         pixel_data_length = None
+        bits_stored = dicom_dataset.get('BitsStored')
+        bits_allocated = dicom_dataset.get('BitsAllocated') or bits_stored
+        pixel_representation = dicom_dataset.get('PixelRepresentation', 0)
         pixel_data_expected_length = None
         if pixel_data and rows and columns and bits_stored:
             pixel_data_length = len(pixel_data)
-            pixel_data_expected_length = rows * columns * (bits_stored / 8)
+            pixel_data_expected_length = (
+                rows * columns * bits_allocated + 7) // 8
 
         # Format output filepath
         output_filepath = (DEFAULT_OUTPUT_DIR / input_file.stem)
-        output_dataset_filepath = output_filepath.with_suffix(
-            JsonConstants.SUFFIX.value)
-        output_image_filepath = output_filepath.with_suffix(
-            PngConstants.SUFFIX.value)
-
-        # Remove DICOM fields specified by the user
-        if remove_dicom_fields:
-            for dicom_fields_name in remove_dicom_fields:
-                if dicom_dataset.get(dicom_fields_name):
-                    dicom_dataset.pop(dicom_fields_name)
-                else:
-                    dicom_error = "Unrecognized DICOM field named '{}'".format(
-                        dicom_fields_name)
-                    logger.warning(dicom_error)
-
-        # Write dataset JSON file
-        dicom_dataset_to_json_meta = dicom_dataset.file_meta.to_json_dict()
-        dicom_dataset_to_json = dicom_dataset.to_json_dict()
-        dicom_json_file = open(str(output_dataset_filepath), "w")
-        dicom_json_file.write(my_json_dumps(
-            {
-                JsonConstants.META.value: dicom_dataset_to_json_meta,
-                JsonConstants.DATA.value: dicom_dataset_to_json
-            }))
-        dicom_json_file.close()
+        output_dataset_filepath = add_suffix(
+            output_filepath, JsonConstants.SUFFIX.value)
 
         # Create image only if Rows, Columns, BitsStored and PixelData are filled
-        if rows and columns and pixel_data and bits_stored:
-            # Extract image from PixelData DICOM file
+        dicom_image = None
+        windowed_image = None
+        if no_image:
+            logger.debug("%s image extraction skipped", str(
+                input_file.resolve()))
+        elif rows and columns and pixel_data and bits_stored:
+            # Extract image dtype from PixelData DICOM file, pixels are
+            # stored on BitsAllocated and signed if PixelRepresentation is 1
             img_dtype = None
-            if bits_stored == 8:
-                img_dtype = np.uint8
-            elif bits_stored == 16:
-                img_dtype = np.uint16
-            else:
-                bits_stored_error = "Unrecognized DICOM BitsStored value '{}'".format(
-                    bits_stored)
-                raise ValueError(bits_stored_error)
-
-            # Check buffer size consistancy
-            if not pixel_data_length == int(pixel_data_expected_length):
+            if image_format != ImageFormatConstants.LZ4.value and bits_allocated not in PNG_BITS_ALLOCATED:
+                # PNG only stores 8 and 16 bits samples, others would be truncated
+                bits_allocated_error = "Unrecognized DICOM BitsAllocated value '{}' for '{}' image format".format(
+                    bits_allocated, image_format)
+                raise ValueError(bits_allocated_error)
+            if bits_allocated != 1:
+                try:
+                    img_dtype = np.dtype("{}int{}".format(
+                        "u" if pixel_representation == 0 else "", bits_allocated))
+                except TypeError:
+                    bits_allocated_error = "Unrecognized DICOM BitsAllocated value '{}'".format(
+                        bits_allocated)
+                    raise ValueError(bits_allocated_error)
+
+            # Check buffer size consistancy, PixelData is padded to an even length
+            if pixel_data_length not in (pixel_data_expected_length,
+                                         pixel_data_expected_length + pixel_data_expected_length % 2):
                 logger.error("%s buffer size is not consistent",
                              str(input_file.resolve()))
-                converted_data.append(DicomConvertedData(
-                    None, input_file.name, str(output_dataset_filepath)))
-                return
-
-            # Write image PNG file
-            dicom_image = np.ndarray((rows, columns),
-                                     img_dtype,
-                                     pixel_data)
-            cv2.imwrite(str(output_image_filepath),
-                        dicom_image)  # pylint: disable=E1101
-
-            # Add full data in the main list
-            converted_data.append(DicomConvertedData(
-                str(output_image_filepath), input_file.name, str(output_dataset_filepath)))
+            else:
+                if img_dtype is None:
+                    # 1 bit pixels are packed, least significant bit first
+                    dicom_image = np.unpackbits(
+                        np.frombuffer(pixel_data, dtype=np.uint8),
+                        bitorder="little")[:rows * columns].reshape(rows, columns)
+                else:
+                    dicom_image = np.frombuffer(
+                        pixel_data, dtype=img_dtype,
+                        count=rows * columns).reshape(rows, columns)
+
+                if window:
+                    window_center = dicom_dataset.get('WindowCenter')
+                    window_width = dicom_dataset.get('WindowWidth')
+                    rescale_slope = dicom_dataset.get('RescaleSlope', 1.0)
+                    rescale_intercept = dicom_dataset.get(
+                        'RescaleIntercept', 0.0)
+                    if window_center is None or window_width is None:
+                        # No VOI window: use the full range of the modality values
+                        modality_min = float(dicom_image.min()) * float(rescale_slope) + float(rescale_intercept)
+                        modality_max = float(dicom_image.max()) * float(rescale_slope) + float(rescale_intercept)
+                        window_center = (modality_min + modality_max) / 2
+                        window_width = abs(modality_max - modality_min)
+                    else:
+                        # Multi-valued windows: keep the first one
+                        if isinstance(window_center, MultiValue):
+                            window_center = window_center[0]
+                        if isinstance(window_width, MultiValue):
+                            window_width = window_width[0]
+                    windowed_image = window_image(dicom_image, window_center, window_width,
+                                                  rescale_slope, rescale_intercept)
         else:
             logger.warning("%s has no Rows or Columns or BitsStored or PixelData DICOM fields", str(
                 input_file.resolve()))
-            converted_data.append(DicomConvertedData(
-                None, input_file.name, str(output_dataset_filepath)))
+
+        # Encode image files in helper threads (encoders release the GIL)
+        # while the JSON data is built
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            image_future = None
+            if dicom_image is not None:
+                image_future = executor.submit(
+                    write_image, output_filepath, dicom_image, image_format, png_compression,
+                    output_dir_fd)
+            # Windowed image is a display preview, written next to the lossless image
+            window_future = None
+            if windowed_image is not None:
+                window_future = executor.submit(
+                    write_image, add_suffix(
+                        output_filepath, PngConstants.WINDOW.value),
+                    windowed_image, ImageFormatConstants.PNG.value, png_compression,
+                    output_dir_fd)
+
+            # Remove DICOM fields specified by the user
+            if remove_dicom_fields:
+                for dicom_fields_name in remove_dicom_fields:
+                    if dicom_dataset.get(dicom_fields_name):
+                        dicom_dataset.pop(dicom_fields_name)
+                    else:
+                        dicom_error = "Unrecognized DICOM field named '{}'".format(
+                            dicom_fields_name)
+                        logger.warning(dicom_error)
+
+            # PixelData is saved in the image file, do not encode it in base64 in the JSON file,
+            # only when json2dicom rebuilds it bit-exact from that image (8 or 16 bits samples)
+            if image_future and bits_allocated in LOSSLESS_BITS_ALLOCATED:
+                dicom_dataset.pop('PixelData', None)
+
+            dicom_dataset_to_json_meta = dicom_dataset.file_meta.to_json_dict()
+            dicom_dataset_to_json = dicom_dataset.to_json_dict()
+
+            # Wait for the image files before writing the JSON file: if an
+            # encoder fails, no JSON file is left without its PixelData
+            output_image_filepath = None
+            if image_future:
+                output_image_filepath = str(image_future.result())
+            if window_future:
+                window_future.result()
+
+        # Write dataset JSON file
+        with open_output_file(output_dataset_filepath, "wb", output_dir_fd,
+                              buffering=JSON_BUFFER_SIZE) as dicom_json_file:
+            my_json_dump(
+                {
+                    JsonConstants.META.value: dicom_dataset_to_json_meta,
+                    JsonConstants.DATA.value: dicom_dataset_to_json
+                }, dicom_json_file, compact)
+
+        return DicomConvertedData(
+            output_image_filepath, input_file.name, str(output_dataset_filepath))
     except (FileNotFoundError,
             InvalidDicomError,
             PermissionError,
@@ -138,20 +501,70 @@ def convert_dicom_to_data(input_file, remove_dicom_fields, converted_data):
         raise error
 
 
-def dicom2json(input_files, remove_dicom_fields):
+def _convert_in_worker(input_file, **kwargs):
+    """_convert_in_worker
+    convert_dicom_to_data with the output directory of the worker process
+
+    Arguments:
+        input_file {str} -- DICOM file location
+        kwargs {dict} -- convert_dicom_to_data arguments
+
+    Returns:
+        DicomConvertedData -- Converted DICOM item
+    """
+    return convert_dicom_to_data(input_file, output_dir_fd=_worker_output_dir_fd, **kwargs)
+
+
+def dicom2json(input_files, remove_dicom_fields,
+               png_compression=DEFAULT_PNG_COMPRESSION,
+               image_format=DEFAULT_IMAGE_FORMAT,
+               compact=False,
+               jobs=DEFAULT_JOBS,
+               window=False,
+               no_image=False):
     """
     Convert DICOM file to JSON using pydicom library
 
     Arguments:
         input_files {str} -- DICOM files location
         remove_dicom_fields {list} -- DICOM field name to not save in JSON
+        png_compression {int} -- PNG compression level (0-9)
+        image_format {str} -- Image format (see ImageFormatConstants)
+        compact {bool} -- Write minified JSON without key sorting
+        jobs {int} -- Number of worker processes
+        window {bool} -- Also write 8 bits PNG previews windowed with WindowCenter/WindowWidth
+        no_image {bool} -- Do not read PixelData nor write the image files
     """
     try:
-        converted_data = []
-        for input_file in input_files:
-            logger.debug("Convert %s", str(input_file.resolve()))
-            convert_dicom_to_data(
-                input_file, remove_dicom_fields, converted_data)
+        convert_arguments = {
+            "remove_dicom_fields": remove_dicom_fields,
+            "png_compression": png_compression,
+            "image_format": image_format,
+            "compact": compact,
+            "window": window,
+            "no_image": no_image
+        }
+        # Each file is independent: convert them in parallel processes,
+        # each one opens the output directory once
+        if jobs > 1 and len(input_files) > 1:
+            log_queue = multiprocessing.Queue()
+            log_listener = handlers.QueueListener(
+                log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+            log_listener.start()
+            try:
+                with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                         initargs=(log_queue,)) as executor:
+                    converted_data = list(executor.map(
+                        partial(_convert_in_worker, **convert_arguments),
+                        input_files,
+                        chunksize=max(1, len(input_files) // (jobs * JOBS_BATCHES))))
+            finally:
+                log_listener.stop()
+        else:
+            with output_directory() as output_dir_fd:
+                converted_data = [convert_dicom_to_data(input_file, output_dir_fd=output_dir_fd,
+                                                        **convert_arguments)
+                                  for input_file in input_files]
 
         output_template_filepath = (DEFAULT_OUTPUT_DIR / Path("_dicom2json")).with_suffix(
             JsonConstants.SUFFIX.value)
@@ -164,10 +577,10 @@ def dicom2json(input_files, remove_dicom_fields):
                 JsonConstants.IMAGE.value: data.image,
                 JsonConstants.OUTPUT.value: data.output
             })
-        dicom_json_template_file = open(output_template_filepath, "w")
-        dicom_json_template_file.write(
-            my_json_dumps(converted_data_json_object))
-        dicom_json_template_file.close()
+        with open(output_template_filepath, "wb",
+                  buffering=JSON_BUFFER_SIZE) as dicom_json_template_file:
+            my_json_dump(converted_data_json_object,
+                         dicom_json_template_file, compact)
 
         logger.debug("Output files for have been writed at: '%s'",
                      DEFAULT_OUTPUT_DIR)
@@ -207,10 +620,62 @@ def main():
         type=str,
         help=remove_dicom_fields_help,
         default=None)
+    parser.add_argument(
+        "-pc",
+        "--png-compression",
+        type=int,
+        choices=range(0, 10),
+        metavar="[0-9]",
+        help="PNG compression level, from 0 (none) to 9 (smallest file but slowest). Default: {}".format(
+            DEFAULT_PNG_COMPRESSION),
+        default=DEFAULT_PNG_COMPRESSION)
+    parser.add_argument(
+        "-if",
+        "--image-format",
+        type=str,
+        choices=[image_format.value for image_format in ImageFormatConstants],
+        help="image format used to store PixelData: 'png' (OpenCV), \
+            'lz4' (byte-shuffled LZ4 frame, fastest) or 'fpnge' (fast PNG encoder). Default: {}".format(
+            DEFAULT_IMAGE_FORMAT),
+        default=DEFAULT_IMAGE_FORMAT)
+    parser.add_argument(
+        "-c",
+        "--compact",
+        action="store_true",
+        help="write minified JSON files, without indentation and key sorting")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of DICOM files converted in parallel. Default: number of CPUs ({})".format(
+            DEFAULT_JOBS),
+        default=DEFAULT_JOBS)
+    parser.add_argument(
+        "-w",
+        "--window",
+        action="store_true",
+        help="also write a 8 bits PNG preview '<name>_window.png' for display, windowed with \
+            WindowCenter/WindowWidth (and rescaled with RescaleSlope/RescaleIntercept). \
+            The lossless image used by json2dicom is still written")
+    parser.add_argument(
+        "-ni",
+        "--no-image",
+        action="store_true",
+        help="only write the JSON files: PixelData is neither read nor saved")
 
     args = parser.parse_args()
     input_files = args.input_files
     remove_dicom_fields = args.remove_dicom_fields
+    png_compression = args.png_compression
+    image_format = args.image_format
+    compact = args.compact
+    jobs = args.jobs
+    window = args.window
+    no_image = args.no_image
+    if jobs < 1:
+        jobs_error = "{} is not a valid number of jobs, abort dicom2json execution!".format(
+            jobs)
+        raise ValueError(jobs_error)
 
     files = []
     for input_file in input_files:
@@ -230,7 +695,9 @@ def main():
             raise ValueError(input_is_not_file_error)
 
     try:
-        dicom2json(files, remove_dicom_fields)
+        dicom2json(files, remove_dicom_fields,
+                   png_compression, image_format, compact, jobs, window,
+                   no_image)
     except Exception as error:
         raise error
 
@@ -7,8 +7,9 @@ import logging
 from logging import config
 import yaml
 import cv2
+import numpy as np
 from pydicom.dataset import Dataset, FileDataset
-from constants import DicomConstants, JsonConstants, PngConstants
+from constants import DicomConstants, JsonConstants, Lz4Constants, PngConstants
 
 DEFAULT_OUTPUT_DIR = Path(__file__).parent / Path("output")
 
@@ -20,6 +21,71 @@ with open(Path(__file__).parent / Path("logger_config.yaml"), 'rt') as f:
 logger = logging.getLogger('root')
 
 
+def read_image(image_filepath, dicom_dataset):
+    """
+    Read image written by dicom2json
+
+    Args:
+        image_filepath (Path): Image filepath (PNG or byte-shuffled LZ4)
+        dicom_dataset (Dataset): Template dataset, gives the LZ4 image geometry
+
+    Raises:
+        ValueError: Missing lz4 library or template geometry
+
+    Returns:
+        numpy.ndarray: Image pixels
+    """
+    if image_filepath.suffix != Lz4Constants.SUFFIX.value:
+        return cv2.imread(str(image_filepath),
+                          flags=cv2.IMREAD_UNCHANGED)
+
+    try:
+        import lz4.frame
+    except ImportError:
+        raise ValueError(
+            "'lz4' python package is required to read '{}'".format(image_filepath))
+
+    rows = dicom_dataset.get('Rows')
+    columns = dicom_dataset.get('Columns')
+    bits_allocated = dicom_dataset.get('BitsAllocated')
+    if not (rows and columns and bits_allocated):
+        geometry_error = "'{}' template needs Rows, Columns and BitsAllocated to read LZ4 image".format(
+            image_filepath)
+        raise ValueError(geometry_error)
+
+    # Revert the byte-shuffle done by dicom2json, 1 bit pixels were unpacked to 8 bits
+    itemsize = max(1, (bits_allocated + 7) // 8)
+    with open(str(image_filepath), "rb") as image_file:
+        shuffled_image = np.frombuffer(
+            lz4.frame.decompress(image_file.read()), dtype=np.uint8)
+    image = np.ascontiguousarray(shuffled_image.reshape(itemsize, -1).T)
+    return image.view("<u{}".format(itemsize)).reshape(rows, columns)
+
+
+def find_invalid_fields(data_dict, dicom_json_values):
+    """
+    Find DICOM fields which cannot be parsed, by bisecting the fields
+    list: valid halves are checked with a single parsing
+
+    Args:
+        data_dict (dict): DICOM data described in JSON
+        dicom_json_values (list): DICOM field tags to check
+
+    Returns:
+        list: DICOM field tags with an invalid value
+    """
+    try:
+        Dataset.from_json({dicom_json_value: data_dict[dicom_json_value]
+                           for dicom_json_value in dicom_json_values})
+        return []
+    except (json.JSONDecodeError, TypeError, ValueError):
+        if len(dicom_json_values) == 1:
+            return list(dicom_json_values)
+    middle = len(dicom_json_values) // 2
+    return (find_invalid_fields(data_dict, dicom_json_values[:middle]) +
+            find_invalid_fields(data_dict, dicom_json_values[middle:]))
+
+
 def convert_data_to_dicom(input_filepath, input_json):
     """
     Convert data available in input_json to DICOM file
@@ -46,8 +112,8 @@ def convert_data_to_dicom(input_filepath, input_json):
             template_filepath)
         raise ValueError(template_is_not_file)
 
-    template_file = open(template_filepath, "r")
-    current_json = json.loads(template_file.read())
+    with open(template_filepath, "r") as template_file:
+        current_json = json.load(template_file)
 
     # Override template object if 'data' key is present
     if JsonConstants.DATA.value in input_json:
@@ -59,28 +125,27 @@ def convert_data_to_dicom(input_filepath, input_json):
     if JsonConstants.OUTPUT.value in input_json:
         output_filename = input_json[JsonConstants.OUTPUT.value]
 
-    dicom_dataset = Dataset()
-    dicom_meta = Dataset()
-
-    # Parse each data DICOM value, to test if valid
+    # Parse all data DICOM values at once, look for the invalid ones only on error
     data_dict = current_json[JsonConstants.DATA.value]
-    dicom_fields_with_error = []
-    for dicom_json_value in data_dict:
-        dicom_dict = {
-            dicom_json_value: data_dict.get(dicom_json_value)}
-        try:
-            Dataset().from_json(json.dumps(dicom_dict))
-        except (json.JSONDecodeError, TypeError, ValueError) as exception_error:
-            dicom_fields_with_error.append(dicom_json_value)
+    try:
+        dicom_dataset = Dataset.from_json(data_dict)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        dicom_fields_with_error = set(find_invalid_fields(
+            data_dict, list(data_dict)))
+        for dicom_json_value in dicom_fields_with_error:
             logger.warning("%s cannot add the field '%s', because the value is not standard with the VR: '%s'",
-                           input_filepath, dicom_json_value, dicom_dict)
-    # Remove error DICOM fields
-    for dicom_field_with_error in dicom_fields_with_error:
-        del data_dict[dicom_field_with_error]
+                           input_filepath, dicom_json_value,
+                           {dicom_json_value: data_dict.get(dicom_json_value)})
+        # Keep only valid DICOM fields
+        data_dict = {dicom_json_value: dicom_json_data
+                     for dicom_json_value, dicom_json_data in data_dict.items()
+                     if dicom_json_value not in dicom_fields_with_error}
+        dicom_dataset = None
 
     try:
-        dicom_dataset = Dataset().from_json(data_dict)
-        dicom_meta = Dataset().from_json(
+        if dicom_dataset is None:
+            dicom_dataset = Dataset.from_json(data_dict)
+        dicom_meta = Dataset.from_json(
             current_json[JsonConstants.META.value])
     except (json.JSONDecodeError, TypeError, ValueError) as exception_error:
         exception_error = "Error encountered during JSON parsing: \"{}\", abort json2dicom execution!".format(
@@ -102,8 +167,7 @@ def convert_data_to_dicom(input_filepath, input_json):
                     image_filepath)
                 raise ValueError(image_is_not_file)
 
-            image = cv2.imread(str(image_filepath),
-                               flags=cv2.IMREAD_UNCHANGED)
+            image = read_image(image_filepath, dicom_dataset)
             shape = image.shape
             bit_depth = None
             if len(shape) < 3:
@@ -124,8 +188,9 @@ def convert_data_to_dicom(input_filepath, input_json):
     if output_filename:
         output_filepath = (DEFAULT_OUTPUT_DIR / Path(output_filename))
     else:
-        output_filepath = (
-            DEFAULT_OUTPUT_DIR / dicom_dataset.SOPInstanceUID).with_suffix(DicomConstants.SUFFIX.value)
+        # Append the suffix, with_suffix would cut the UID at its last dot
+        output_filepath = DEFAULT_OUTPUT_DIR / \
+            (dicom_dataset.SOPInstanceUID + DicomConstants.SUFFIX.value)
 
     dataset = FileDataset(output_filepath.stem,
                           dicom_dataset, file_meta=dicom_meta, preamble=b"\0" * 128)
@@ -146,8 +211,8 @@ def json2dicom(input_filepath):
         error: Error encountered during conversion
     """
     try:
-        input_file = open(input_filepath, "r")
-        input_json = json.loads(input_file.read())
+        with open(input_filepath, "r") as input_file:
+            input_json = json.load(input_file)
 
         if isinstance(input_json, list):
             for json_object in input_json: